@@ -1,22 +1,43 @@
+import json
 import os
 from dotenv import load_dotenv
-import time
-from datetime import datetime, timedelta
-from O365 import Account
+from datetime import date, datetime, timedelta
+from lxml import html
 from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import JavascriptException, TimeoutException
 from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.client_config import ClientConfig
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.select import Select
 from selenium.webdriver.support.ui import WebDriverWait
+from council_page import DATE_RE, collection_row, details
+
+load_dotenv()  # Load environment variables from .env file once, on import
+
+# Locators for the council's bin collection form
+_POSTCODE_RADIO = (By.CSS_SELECTOR, "label[for='searchBy_radio_1']")
+_POSTCODE_TEXTBOX = (By.ID, "Postcode_textbox")
+_ADDRESS_LOOKUP_BUTTON = (By.ID, "AddressLookup_button")
+_SELECT_ADDRESS_BUTTON = (By.ID, "SelectAddress_button")
+
+# Last scraped collection date, reused by re-runs on the same day
+_RESULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "blackbin", "last_result.json")
+
+# Selects the address option by its visible text in one call; throws when there is no such option
+_SELECT_ADDRESS_JS = """
+const list = document.getElementById('lstAddresses');
+const option = list && Array.from(list.options).find(o => o.text.replace(/\\s+/g, ' ').trim() === arguments[0]);
+if (!option) { throw new Error('Address not found: ' + arguments[0]); }
+list.value = option.value;
+list.dispatchEvent(new Event('change', {bubbles: true}));
+"""
 
 
 class BlackBin:
     def __init__(self):
-        load_dotenv()  # Load environment variables from .env file
         client_id = os.getenv("CLIENT_ID")
         client_secret = os.getenv("CLIENT_SECRET")
         self.credentials = (client_id, client_secret)
+        self._account = None  # Built on first use and shared by later calendar updates
         self.options = webdriver.ChromeOptions()
         self.options.add_argument("--disable-dev-shm-usage")
         self.options.add_argument("--disable-extensions")
@@ -24,61 +45,117 @@ class BlackBin:
         # self.options.add_argument("--no-sandbox")
         self.options.add_argument("--headless")
         self.options.add_experimental_option("excludeSwitches", ['enable-automation'])
-        user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 " \
-                     "(KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36"
-        self.options.add_argument('--user-agent={}'.format(user_agent))
+        # Only the form and the ItemsGrid table are read, so skip images
+        # and return from get() as soon as the DOM is interactive
+        self.options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+        self.options.page_load_strategy = 'eager'
+        self.user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 " \
+                          "(KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36"
+        self.options.add_argument('--user-agent={}'.format(self.user_agent))
         self.url = "https://online.belfastcity.gov.uk/find-bin-collection-day/Default.aspx"
+        self.selenium_url = "http://selenium-server:4444/wd/hub"
         self.year = int()
         self.month = int()
         self.day = int()
+        self.driver = None
 
     def start_chrome(self):
-        self.driver = webdriver.Remote("http://selenium-server:4444/wd/hub", options=self.options)
+        # The default urllib3 pool holds a single connection, so concurrent commands would queue up
+        client_config = ClientConfig(remote_server_addr=self.selenium_url,
+                                     init_args_for_pool_manager={"init_args_for_pool_manager": {"maxsize": 10}})
+        self.driver = webdriver.Remote(self.selenium_url, options=self.options, client_config=client_config)
+        # With the eager strategy get() returns on DOMContentLoaded; never hang longer than this on a slow site
+        self.driver.set_page_load_timeout(15)
 
     def get_bin(self, house_address):
         house_address = house_address.upper()
         postcode = house_address.split(', ')[2]
         self.driver.get(self.url)
-        time.sleep(1)
         # user_agent = self.driver.execute_script("return navigator.userAgent;")
         # print(user_agent)
-        WebDriverWait(self.driver, 10).until(EC.element_to_be_clickable((By.CSS_SELECTOR, "label[for='searchBy_radio_1']"))).click()
-        WebDriverWait(self.driver, 10).until(EC.presence_of_element_located((By.ID, "Postcode_textbox"))).send_keys(postcode)
-        self.driver.find_element(By.ID, "AddressLookup_button").click()
-        select = Select(self.driver.find_element(By.ID, "lstAddresses"))
+        # Poll every 100 ms rather than the default 500 ms so each step fires as soon as its element is ready
+        wait = WebDriverWait(self.driver, 10, poll_frequency=0.1)
+        wait.until(EC.element_to_be_clickable(_POSTCODE_RADIO)).click()
+        wait.until(EC.presence_of_element_located(_POSTCODE_TEXTBOX)).send_keys(postcode)
+        wait.until(EC.element_to_be_clickable(_ADDRESS_LOOKUP_BUTTON)).click()
         try:
-            select.select_by_visible_text(house_address)
-            self.driver.find_element(By.ID, "SelectAddress_button").click()
-            try:
-                table = self.driver.find_element(By.ID, "ItemsGrid").find_elements(By.TAG_NAME, "tr")[1].text
-                table = table.split(' ')
-                del table[:3]
-                month = table[3]
-                months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
-                          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-                if month in months:
-                    self.month = months.index(month) + 1
-                self.day = int(table[4])
-                self.year = int(table[5])
-                print(table)
-            except NoSuchElementException:
+            # Select() would fetch every option's text and value with separate WebDriver commands
+            self.driver.execute_script(_SELECT_ADDRESS_JS, house_address)
+            wait.until(EC.element_to_be_clickable(_SELECT_ADDRESS_BUTTON)).click()
+            # Fetch the page once and read the grid and the details panel locally, like the HTTP scraper
+            page = html.fromstring(self.driver.page_source)
+            if not self.set_collection_date(collection_row(page)):
                 print("The Information is Is Missing From Belfast City Council Website")
-                info = self.driver.find_element(By.ID, "BinDetailsPnl").text
-                print(info)
+                print(details(page))
                 self.get_exit()
                 quit()
-        except NoSuchElementException:
+        except (JavascriptException, TimeoutException):
             print("The Address Is Incorrect!")
             print(house_address)
             self.get_exit()
             quit()
 
+    def get_bin_http(self, house_address):
+        # Same lookup as get_bin, but over plain HTTP without starting a browser
+        from scraper_http import HttpScraper  # Imported here so the default Selenium path skips requests/shelve
+        house_address = house_address.upper()
+        postcode = house_address.split(', ')[2]
+        scraper = HttpScraper(self.url, self.user_agent)
+        page = scraper.find_address(house_address, postcode)
+        if page is None:
+            print("The Address Is Incorrect!")
+            print(house_address)
+            quit()
+        if not self.set_collection_date(collection_row(page)):
+            print("The Information is Is Missing From Belfast City Council Website")
+            print(details(page))
+            quit()
+
+    def set_collection_date(self, table):
+        match = DATE_RE.search(table) if table else None
+        if match is None:
+            return False
+        # Whitespace in the format matches any run of spaces or tabs between the cells
+        collection = datetime.strptime(match.group(0), '%b %d %Y')
+        self.year, self.month, self.day = collection.year, collection.month, collection.day
+        print(table)
+        return True
+
+    def load_cached_bin(self, house_address):
+        today = date.today()
+        try:
+            with open(_RESULT_CACHE) as f:
+                cached = json.load(f)
+            collection = date(cached['year'], cached['month'], cached['day'])
+            # Only trust today's scrape of the same address, and only while that collection is still ahead
+            if cached['address'] != house_address.upper() or cached['fetched_at'] != today.isoformat() \
+                    or collection < today:
+                return False
+        except (OSError, ValueError, KeyError, TypeError):
+            # Missing, partial or hand-edited cache file: scrape again
+            return False
+        self.year, self.month, self.day = collection.year, collection.month, collection.day
+        return True
+
+    def save_cached_bin(self, house_address):
+        try:
+            os.makedirs(os.path.dirname(_RESULT_CACHE), exist_ok=True)
+            with open(_RESULT_CACHE, 'w') as f:
+                json.dump({'address': house_address.upper(), 'year': self.year, 'month': self.month,
+                           'day': self.day, 'fetched_at': date.today().isoformat()}, f)
+        except OSError:
+            pass  # The cache only saves a scrape; an unwritable ~/.cache must not stop the calendar update
+
     def get_exit(self):
-        self.driver.quit()
+        if self.driver is not None:
+            self.driver.quit()
+            self.driver = None
 
     def update_calendar(self, calendar_name=None):
-        account = Account(self.credentials)
-        schedule = account.schedule()
+        if self._account is None:
+            from O365 import Account  # Imported here so runs that never reach the calendar skip loading O365
+            self._account = Account(self.credentials)
+        schedule = self._account.schedule()
         if not calendar_name:
             calendar = schedule.get_default_calendar()
         else:
@@ -87,11 +164,13 @@ class BlackBin:
         collection_end = collection_start + timedelta(days=1)
         q = calendar.new_query('start').greater_equal(collection_start)
         q.chain('and').on_attribute('end').less_equal(collection_end)
-        events = calendar.get_events(query=q, include_recurring=False)
-        for e in events:
-            if e.subject == 'Bin collection':
-                print("The Event " + "#" + e.subject + "#" + " Is Already In The Calendar")
-                quit()
+        q.chain('and').on_attribute('subject').equals('Bin collection')
+        q.select('subject')  # Only the subject is read back
+        # The subject is filtered server side, so a single match is all that is needed
+        events = list(calendar.get_events(query=q, limit=1, include_recurring=False))
+        if events:
+            print("The Event " + "#" + events[0].subject + "#" + " Is Already In The Calendar")
+            quit()
         collection = calendar.new_event()  # creates a new unsaved event
         collection.subject = 'Bin collection'
         collection.location = 'Belfast'
@@ -103,11 +182,21 @@ class BlackBin:
 
 if __name__ == '__main__':
     # "House_Number Street Name (like: 3 Anna Street), Belfast, POST_CODE"
-    load_dotenv()  # Ensure environment variables are loaded
     house = os.getenv("HOUSE_ADDRESS")
     calendar_name = os.getenv("CALENDAR_NAME", "Events")  # Load event name from .env or use default
     bins = BlackBin()
-    bins.start_chrome()
-    bins.get_bin(house)
-    bins.get_exit()
+    if bins.load_cached_bin(house):
+        print("Using the collection date already fetched today")
+    else:
+        if os.getenv("USE_HTTP_SCRAPER", "false").lower() == "true":
+            bins.get_bin_http(house)
+        else:
+            try:
+                bins.start_chrome()
+                bins.get_bin(house)
+            finally:
+                # Release the session even when a wait or the page load times out; the standalone
+                # Selenium server only runs one session at a time
+                bins.get_exit()
+        bins.save_cached_bin(house)
     bins.update_calendar(calendar_name)
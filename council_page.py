@@ -0,0 +1,28 @@
+# Parsing helpers for the council's result page, shared by the Selenium and HTTP lookups
+import re
+
+# Collection date as shown in the ItemsGrid row, e.g. "Oct 16 2023"
+DATE_RE = re.compile(r'\b(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{1,2}\s+\d{4}\b')
+
+
+def element_by_id(page, element_id):
+    found = page.xpath("//*[@id=$id]", id=element_id)
+    return found[0] if found else None
+
+
+def collection_row(page):
+    # Second ItemsGrid row with its cells joined by spaces, as WebElement.text renders it
+    rows = page.xpath("//*[@id='ItemsGrid']//tr")
+    if len(rows) < 2:
+        return None
+    return ' '.join(' '.join(cell.text_content().split()) for cell in rows[1].xpath("./td|./th"))
+
+
+def details(page):
+    panel = element_by_id(page, "BinDetailsPnl")
+    return '' if panel is None else panel.text_content().strip()
+
+
+def has_collection_date(page):
+    row = collection_row(page)
+    return row is not None and DATE_RE.search(row) is not None
@@ -0,0 +1,101 @@
+import dbm
+import os
+import re
+import shelve
+import time
+import requests
+from lxml import etree, html
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from council_page import element_by_id, has_collection_date
+
+# Target of an ASP.NET postback link/button, e.g. javascript:__doPostBack('AddressLookup$button','')
+_POSTBACK_RE = re.compile(r"__doPostBack\(\\?'([^'\\]*)\\?',\s*\\?'([^'\\]*)")
+
+# Resolved SelectAddress posts, keyed by address, so warm runs skip the postcode search
+_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "blackbin")
+_ADDRESS_CACHE_TTL = 30 * 24 * 60 * 60
+
+# (connect, read) seconds: fail fast on an unreachable host, allow a slow page the same 15 s as Selenium
+_TIMEOUT = (3, 15)
+
+
+# Drives the council's ASP.NET form with plain HTTP posts instead of a browser. Every step submits
+# the form the way the browser does when a control is clicked: the hidden fields (__VIEWSTATE,
+# __EVENTVALIDATION, ...) and current values, plus the clicked button or its __doPostBack target.
+class HttpScraper:
+    def __init__(self, url, user_agent):
+        self.url = url
+        self.session = requests.Session()  # One keep-alive connection for the whole lookup
+        self.session.headers['User-Agent'] = user_agent
+        # Retry connection errors and transient GET failures. Postbacks are not retried on their status:
+        # ASP.NET answers a stale __VIEWSTATE/__EVENTVALIDATION with a 500 that a retry cannot fix.
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=frozenset({'GET'}))
+        self.session.mount('https://', HTTPAdapter(max_retries=retry))
+        self._last_post = None  # (action, data) of the latest form submission
+
+    def find_address(self, house_address, postcode):
+        # Details page for the address, or None when the postcode has no such address
+        try:
+            os.makedirs(_CACHE_DIR, exist_ok=True)
+            cache = shelve.open(os.path.join(_CACHE_DIR, "addresses"))
+        except (OSError, dbm.error[0]):  # dbm.error is the tuple (dbm.error, OSError)
+            # No usable cache (unwritable ~/.cache, corrupt db): do the full lookup without caching
+            return self.select_address(self.lookup_postcode(postcode), house_address)
+        with cache:
+            entry = cache.get(house_address)
+            if entry and time.time() - entry['scraped_at'] < _ADDRESS_CACHE_TTL:
+                try:
+                    page = self._load(self.session.post(entry['action'], data=entry['data'], timeout=_TIMEOUT))
+                    if has_collection_date(page):
+                        return page
+                except (requests.RequestException, etree.LxmlError):
+                    # Failed request, or an empty/non-HTML body the parser rejects
+                    pass
+            # Cache miss, expired entry, or the stored form state no longer yields a collection date
+            cache.pop(house_address, None)
+            page = self.select_address(self.lookup_postcode(postcode), house_address)
+            if page is not None and has_collection_date(page):
+                action, data = self._last_post
+                cache[house_address] = {'action': action, 'data': data, 'scraped_at': time.time()}
+            return page
+
+    def lookup_postcode(self, postcode):
+        page = self._load(self.session.get(self.url, timeout=_TIMEOUT))
+        radio = element_by_id(page, "searchBy_radio_1")
+        if radio is not None:
+            # Set the group's value so the sibling radio that was checked is cleared
+            page.forms[0].inputs[radio.get('name')].value = radio.get('value')
+            if _POSTBACK_RE.search(radio.get('onclick', '')):
+                # The radio button posts back to reveal the postcode search
+                page = self._submit(page, radio)
+        element_by_id(page, "Postcode_textbox").value = postcode
+        return self._submit(page, element_by_id(page, "AddressLookup_button"))
+
+    def select_address(self, page, house_address):
+        # Returns the details page, or None when the postcode has no such address
+        addresses = element_by_id(page, "lstAddresses")
+        if addresses is None:
+            return None
+        for option in addresses.iter('option'):
+            if ' '.join(option.text_content().split()) == house_address:
+                addresses.value = option.get('value', (option.text or '').strip())
+                return self._submit(page, element_by_id(page, "SelectAddress_button"))
+        return None
+
+    @staticmethod
+    def _load(response):
+        response.raise_for_status()
+        return html.fromstring(response.content, base_url=response.url)
+
+    def _submit(self, page, control):
+        form = page.forms[0]
+        data = dict(form.form_values())
+        postback = _POSTBACK_RE.search(control.get('href', '') + control.get('onclick', ''))
+        if postback:
+            data['__EVENTTARGET'], data['__EVENTARGUMENT'] = postback.groups()
+        elif control.get('name'):
+            data[control.get('name')] = control.get('value', '')
+        self._last_post = (form.action or self.url, data)
+        return self._load(self.session.post(*self._last_post, timeout=_TIMEOUT))